@@ -44,6 +44,7 @@ class cstruct:
 
         self.consts = {}
         self.lookups = {}
+        self._expr_cache: dict[str, Expression] = {}
         # fmt: off
         self.typedefs = {
             # Internal types
@@ -212,6 +213,10 @@ class cstruct:
         if not replace and (name in self.typedefs and self.resolve(self.typedefs[name]) != self.resolve(type_)):
             raise ValueError(f"Duplicate type: {name}")
 
+        if replace and name in self.typedefs:
+            # Cached expressions may have folded the size of the replaced type
+            self._expr_cache.clear()
+
         self.typedefs[name] = type_
 
     addtype = add_type
@@ -252,6 +257,9 @@ class cstruct:
         """
         deftype = deftype or cstruct.DEF_CSTYLE
 
+        # Cached expressions may have folded the size of a type that has changed since, e.g. through add_field()
+        self._expr_cache.clear()
+
         if deftype == cstruct.DEF_CSTYLE:
             TokenParser(self, **kwargs).parse(definition)
         elif deftype == cstruct.DEF_LEGACY:
@@ -338,6 +346,15 @@ class cstruct:
         )
         return types.new_class(name, bases, {}, lambda ns: ns.update(attrs))
 
+    def _make_expression(self, expression: str) -> Expression:
+        """Return the compiled expression for the given expression string.
+
+        Expressions are compiled once per load and shared between all users of the same expression string.
+        """
+        if (expr := self._expr_cache.get(expression)) is None:
+            expr = self._expr_cache[expression] = Expression(self, expression)
+        return expr
+
     def _make_array(self, type_: MetaType, num_entries: int | Expression | None) -> ArrayMetaType:
         null_terminated = num_entries is None
         dynamic = isinstance(num_entries, Expression) or type_.dynamic
@@ -1,175 +1,152 @@
 from __future__ import annotations
 
+import operator
+import re
 import string
-from typing import TYPE_CHECKING, Callable
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any
 
-from dissect.cstruct.exceptions import ExpressionParserError, ExpressionTokenizerError
+from dissect.cstruct.exceptions import (
+    ExpressionParserError,
+    ExpressionTokenizerError,
+    ResolveError,
+)
 
 if TYPE_CHECKING:
     from dissect.cstruct import cstruct
 
 
-HEXBIN_SUFFIX = {"x", "X", "b", "B"}
+HEXBIN_SUFFIX = frozenset({"x", "X", "b", "B"})
+# Token for a unary minus, this can never be an identifier
+UNARY_MINUS = "u-"
+# A '-' following one of these tokens (or at the start of an expression) is a unary minus
+UNARY_MINUS_PREFIX = frozenset({"|", "^", "&", "<<", ">>", "+", "-", "*", "/", "%", UNARY_MINUS, "~", "("})
+NUMBER_RE = re.compile(r"0[xX][0-9a-fA-F]+|0[bB][01]+|0[oO][0-7]+|0|[1-9][0-9]*")
 
+# Runs of characters the tokenizer matches in one go, the number suffix is matched but not part of the token
+NUMBER_TOKEN_RE = re.compile(r"(\d[xXbBoO]?[0-9a-fA-F]*)(?:[uU][lL]{0,2}|[lL]{1,2}[uU]?)?")
+IDENTIFIER_RE = re.compile(r"[a-zA-Z_][a-zA-Z0-9_]*")
+WHITESPACE_RE = re.compile(r"[ \t]+")
+OPERATOR_RE = re.compile(r">>|<<|[*/+\-%&^|()~]")
+# C style octal numbers (e.g. 012) are rewritten to Python notation (e.g. 0o12) before tokenizing
+OCTAL_RE = re.compile(r"\b0([0-7]+)(?=(?:[uU][lL]{0,2}|[lL]{1,2}[uU]?)?\b)")
 
-class ExpressionTokenizer:
-    def __init__(self, expression: str):
-        self.expression = expression
-        self.pos = 0
-        self.tokens = []
-
-    def equal(self, token: str, expected: str | set[str]) -> bool:
-        if isinstance(expected, set):
-            return token in expected
-        else:
-            return token == expected
+# Character classes of the ASCII range, used by the tokenizer to classify a character with a single table lookup
+CHAR_DIGIT = 0x01
+CHAR_IDENTIFIER = 0x02
+CHAR_OPERATOR = 0x04
+CHAR_WHITESPACE = 0x08
 
-    def alnum(self, token: str) -> bool:
-        return token.isalnum()
 
-    def alpha(self, token: str) -> bool:
-        return token.isalpha()
+def _char_classes() -> bytes:
+    table = bytearray(128)
+    for chars, flag in (
+        (string.digits, CHAR_DIGIT | CHAR_IDENTIFIER),
+        (string.ascii_letters + "_", CHAR_IDENTIFIER),
+        ("*/+-%&^|()~<>", CHAR_OPERATOR),
+        (" \t", CHAR_WHITESPACE),
+    ):
+        for char in chars:
+            table[ord(char)] |= flag
+    return bytes(table)
 
-    def digit(self, token: str) -> bool:
-        return token.isdigit()
 
-    def hexdigit(self, token: str) -> bool:
-        return token in string.hexdigits
+CHAR_CLASSES = _char_classes()
 
-    def operator(self, token: str) -> bool:
-        return token in {"*", "/", "+", "-", "%", "&", "^", "|", "(", ")", "~"}
+_EMPTY_CONTEXT = MappingProxyType({})
 
-    def match(
-        self,
-        func: Callable[[str], bool] | None = None,
-        expected: str | None = None,
-        consume: bool = True,
-        append: bool = True,
-    ) -> bool:
-        if self.eol():
-            return False
+# Postfix instruction kinds, literals carry their int value and binary operators the function implementing them
+OP_LITERAL = 0
+OP_NAME = 1
+OP_SIZEOF = 2
+OP_NEGATE = 3
+OP_INVERT = 4
+OP_BINARY = 5
 
-        token = self.get_token()
 
-        if expected and self.equal(token, expected):
-            if append:
-                self.tokens.append(token)
-            if consume:
-                self.consume()
-            return True
-
-        if func and func(token):
-            if append:
-                self.tokens.append(token)
-            if consume:
-                self.consume()
-            return True
-
-        return False
-
-    def consume(self) -> None:
-        self.pos += 1
-
-    def eol(self) -> bool:
-        return self.pos >= len(self.expression)
-
-    def get_token(self) -> str:
-        if self.eol():
-            raise ExpressionTokenizerError(f"Out of bounds index: {self.pos}, length: {len(self.expression)}")
-        return self.expression[self.pos]
+class ExpressionTokenizer:
+    def __init__(self, expression: str):
+        self.expression = OCTAL_RE.sub(r"0o\1", expression)
+        self.pos = 0
+        self.tokens = []
 
     def tokenize(self) -> list[str]:
-        token = ""
+        expression = self.expression
+        length = len(expression)
+        tokens = self.tokens
+        classes = CHAR_CLASSES
+        number_match = NUMBER_TOKEN_RE.match
+        identifier_match = IDENTIFIER_RE.match
+        whitespace_match = WHITESPACE_RE.match
+        operator_match = OPERATOR_RE.match
 
         # Loop over expression runs in linear time
-        while not self.eol():
-            # If token is a single character operand add it to tokens
-            if self.match(self.operator):
-                continue
-
-            # If token is a single digit, keep looping over expression and build the number
-            elif self.match(self.digit, consume=False, append=False):
-                token += self.get_token()
-                self.consume()
-
-                # Support for binary and hexadecimal notation
-                if self.match(expected=HEXBIN_SUFFIX, consume=False, append=False):
-                    token += self.get_token()
-                    self.consume()
-
-                while self.match(self.hexdigit, consume=False, append=False):
-                    token += self.get_token()
-                    self.consume()
-                    if self.eol():
-                        break
-
-                # Checks for suffixes in numbers
-                if self.match(expected={"u", "U"}, consume=False, append=False):
-                    self.consume()
-                    self.match(expected={"l", "L"}, append=False)
-                    self.match(expected={"l", "L"}, append=False)
-
-                elif self.match(expected={"l", "L"}, append=False):
-                    self.match(expected={"l", "L"}, append=False)
-                    self.match(expected={"u", "U"}, append=False)
-                else:
-                    pass
+        i = self.pos
+        while i < length:
+            char = expression[i]
+            char_class = classes[code] if (code := ord(char)) < 128 else 0
+
+            # If token is an operator, match it including the two character shift operators
+            if char_class & CHAR_OPERATOR:
+                if (match := operator_match(expression, i)) is None:
+                    raise ExpressionTokenizerError(f"Tokenizer does not recognize following token '{char}'")
+
+                token = match.group()
+                # Unary minus tokens; we change the semantic of '-' depending on the previous token
+                if token == "-" and (not tokens or tokens[-1] in UNARY_MINUS_PREFIX):
+                    token = UNARY_MINUS
+                tokens.append(token)
+                i = match.end()
+
+            # If token is a single digit, match the whole number including an optional suffix
+            elif char_class & CHAR_DIGIT:
+                start = i
+                match = number_match(expression, i)
+                token = match.group(1)
+                i = match.end()
 
                 # Number cannot end on x or b in the case of binary or hexadecimal notation
                 if len(token) == 2 and token[-1] in HEXBIN_SUFFIX:
                     raise ExpressionTokenizerError("Invalid binary or hex notation")
 
-                if len(token) > 1 and token[0] == "0" and token[1] not in HEXBIN_SUFFIX:
-                    token = token[:1] + "o" + token[1:]
-                self.tokens.append(token)
-                token = ""
-
-            # If token is alpha or underscore we need to build the identifier
-            elif self.match(self.alpha, consume=False, append=False) or self.match(
-                expected="_", consume=False, append=False
-            ):
-                while self.match(self.alnum, consume=False, append=False) or self.match(
-                    expected="_", consume=False, append=False
-                ):
-                    token += self.get_token()
-                    self.consume()
-                    if self.eol():
-                        break
-                self.tokens.append(token)
-                token = ""
-            # If token is length 2 operand make sure next character is part of length 2 operand append to tokens
-            elif self.match(expected=">", append=False) and self.match(expected=">", append=False):
-                self.tokens.append(">>")
-            elif self.match(expected="<", append=False) and self.match(expected="<", append=False):
-                self.tokens.append("<<")
-            elif self.match(expected={" ", "\t"}, append=False):
-                continue
+                if not NUMBER_RE.fullmatch(token):
+                    raise ExpressionTokenizerError(f"Invalid number notation '{expression[start:i]}'")
+                tokens.append(token)
+
+            # If token is alpha or underscore, match the whole identifier
+            elif char_class & CHAR_IDENTIFIER:
+                match = identifier_match(expression, i)
+                tokens.append(match.group())
+                i = match.end()
+
+            elif char_class & CHAR_WHITESPACE:
+                i = whitespace_match(expression, i).end()
             else:
-                raise ExpressionTokenizerError(
-                    f"Tokenizer does not recognize following token '{self.expression[self.pos]}'"
-                )
-        return self.tokens
+                raise ExpressionTokenizerError(f"Tokenizer does not recognize following token '{char}'")
+
+        self.pos = i
+        return tokens
 
 
 class Expression:
     """Expression parser for calculations in definitions."""
 
     binary_operators = {
-        "|": lambda a, b: a | b,
-        "^": lambda a, b: a ^ b,
-        "&": lambda a, b: a & b,
-        "<<": lambda a, b: a << b,
-        ">>": lambda a, b: a >> b,
-        "+": lambda a, b: a + b,
-        "-": lambda a, b: a - b,
-        "*": lambda a, b: a * b,
-        "/": lambda a, b: a // b,
-        "%": lambda a, b: a % b,
+        "|": operator.or_,
+        "^": operator.xor,
+        "&": operator.and_,
+        "<<": operator.lshift,
+        ">>": operator.rshift,
+        "+": operator.add,
+        "-": operator.sub,
+        "*": operator.mul,
+        "/": operator.floordiv,
+        "%": operator.mod,
     }
 
     unary_operators = {
-        "u": lambda a: -a,
-        "~": lambda a: ~a,
+        UNARY_MINUS: operator.neg,
+        "~": operator.invert,
     }
 
     precedence_levels = {
@@ -183,123 +160,215 @@ class Expression:
         "*": 5,
         "/": 5,
         "%": 5,
-        "u": 6,
+        UNARY_MINUS: 6,
         "~": 6,
         "sizeof": 6,
     }
 
+    operators = frozenset(binary_operators) | frozenset(unary_operators)
+
     def __init__(self, cstruct: cstruct, expression: str):
         self.cstruct = cstruct
         self.expression = expression
-        self.tokens = ExpressionTokenizer(expression).tokenize()
-        self.stack = []
-        self.queue = []
+        self.tokens = self._fold_sizeof(ExpressionTokenizer(expression).tokenize())
+        self._sizeof_cache: dict[str, int] = {}
+        self._max_stack = 0
+        self._postfix = self._compile()
+        self._needs_context = any(kind == OP_NAME for kind, _ in self._postfix)
+        self._const_value = None if self._needs_context else self._fold_constant()
+
+        # Expressions without names or deferred sizeofs always evaluate to the same value, skip evaluating those
+        if self._const_value is not None:
+            self.evaluate = self._evaluate_constant
+        # Most other expressions are a single name or sizeof, skip the postfix machinery for those
+        elif len(self._postfix) == 1:
+            kind, self._operand = self._postfix[0]
+            self.evaluate = self._evaluate_name if kind == OP_NAME else self._evaluate_sizeof
 
     def __repr__(self) -> str:
         return self.expression
 
-    def precedence(self, o1: str, o2: str) -> bool:
-        return self.precedence_levels[o1] >= self.precedence_levels[o2]
+    def _fold_sizeof(self, tokens: list[str]) -> list[str]:
+        """Replace ``sizeof(name)`` token sequences with the size of ``name`` if it can already be resolved.
+
+        Types that can't be resolved yet (e.g. forward declarations) or that are dynamically sized are left as is
+        and are resolved during evaluation instead.
+        """
+        result = []
+
+        i = 0
+        while i < len(tokens):
+            if tokens[i] == "sizeof" and tokens[i + 1 : i + 2] == ["("] and tokens[i + 3 : i + 4] == [")"]:
+                try:
+                    size = len(self.cstruct.resolve(tokens[i + 2]))
+                except (ResolveError, TypeError):
+                    pass
+                else:
+                    result.append(str(size))
+                    i += 4
+                    continue
+
+            result.append(tokens[i])
+            i += 1
 
-    def evaluate_exp(self) -> None:
-        operator = self.stack.pop(-1)
-        res = 0
+        return result
 
-        if len(self.queue) < 1:
-            raise ExpressionParserError("Invalid expression: not enough operands")
+    def _sizeof(self, name: str) -> int:
+        """Return the size of the type ``name`` for a ``sizeof`` that couldn't be folded at compile time."""
+        if (size := self._sizeof_cache.get(name)) is None:
+            size = self._sizeof_cache[name] = len(self.cstruct.resolve(name))
+        return size
 
-        right = self.queue.pop(-1)
-        if operator in self.unary_operators:
-            res = self.unary_operators[operator](right)
-        else:
-            if len(self.queue) < 1:
-                raise ExpressionParserError("Invalid expression: not enough operands")
+    def _fold_constant(self) -> int | None:
+        """Evaluate the expression once if its value doesn't depend on names or types that aren't known yet."""
+        if any(kind == OP_SIZEOF for kind, _ in self._postfix):
+            return None
 
-            left = self.queue.pop(-1)
-            res = self.binary_operators[operator](left, right)
+        try:
+            return self.evaluate()
+        except (ArithmeticError, ValueError):
+            # Leave errors such as a division by zero to be raised on evaluation
+            return None
 
-        self.queue.append(res)
+    def _evaluate_constant(self, context: dict[str, int] | None = None) -> int:
+        return self._const_value
 
-    def is_number(self, token: str) -> bool:
-        return token.isnumeric() or (len(token) > 2 and token[0] == "0" and token[1] in ("x", "X", "b", "B", "o", "O"))
+    def _evaluate_name(self, context: dict[str, int] | None = None) -> int:
+        name = self._operand
 
-    def evaluate(self, context: dict[str, int] | None = None) -> int:
-        """Evaluates an expression using a Shunting-Yard implementation."""
+        if context and (value := context.get(name)) is not None:
+            return int(value)
 
-        self.stack = []
-        self.queue = []
-        operators = set(self.binary_operators.keys()) | set(self.unary_operators.keys())
+        if (value := self.cstruct.consts.get(name)) is not None:
+            return int(value)
 
-        context = context or {}
-        tmp_expression = self.tokens
+        raise ExpressionParserError(f"Unmatched token: '{name}'")
 
-        # Unary minus tokens; we change the semantic of '-' depending on the previous token
-        for i in range(len(self.tokens)):
-            if self.tokens[i] == "-":
-                if i == 0:
-                    self.tokens[i] = "u"
-                    continue
-                if self.tokens[i - 1] in operators or self.tokens[i - 1] == "u" or self.tokens[i - 1] == "(":
-                    self.tokens[i] = "u"
-                    continue
+    def _evaluate_sizeof(self, context: dict[str, int] | None = None) -> int:
+        return self._sizeof(self._operand)
+
+    def _compile(self) -> list[tuple[int, Any]]:
+        """Convert the tokens to a list of postfix instructions using a Shunting-Yard implementation.
+
+        The expression is validated in the process, so evaluating the instructions only has to look up names.
+        """
+        operators = self.operators
+        unary = self.unary_operators
+        binary = self.binary_operators
+        prec = self.precedence_levels
+
+        tokens = self.tokens
+        num_tokens = len(tokens)
+
+        output = []
+        emit = output.append
+        stack = []
+        depth = max_depth = 0
+
+        def pop_operator() -> None:
+            nonlocal depth
+
+            operator = stack.pop()
+            if operator in unary:
+                if depth < 1:
+                    raise ExpressionParserError("Invalid expression: not enough operands")
+                emit((OP_NEGATE if operator == UNARY_MINUS else OP_INVERT, None))
+            else:
+                if depth < 2:
+                    raise ExpressionParserError("Invalid expression: not enough operands")
+                emit((OP_BINARY, binary[operator]))
+                depth -= 1
 
         i = 0
-        while i < len(tmp_expression):
-            current_token = tmp_expression[i]
-            if self.is_number(current_token):
-                self.queue.append(int(current_token, 0))
-            elif current_token in context:
-                self.queue.append(int(context[current_token]))
-            elif current_token in self.cstruct.consts:
-                self.queue.append(int(self.cstruct.consts[current_token]))
-            elif current_token in self.unary_operators:
-                self.stack.append(current_token)
+        while i < num_tokens:
+            current_token = tokens[i]
+            # The tokenizer only emits valid numbers and identifiers can't start with a digit
+            if "0" <= current_token[0] <= "9":
+                emit((OP_LITERAL, int(current_token, 0)))
+                depth += 1
+                max_depth = max(max_depth, depth)
+            elif current_token in unary:
+                stack.append(current_token)
             elif current_token == "sizeof":
-                if len(tmp_expression) < i + 3 or (tmp_expression[i + 1] != "(" or tmp_expression[i + 3] != ")"):
+                if num_tokens < i + 4 or tokens[i + 1] != "(" or tokens[i + 3] != ")":
                     raise ExpressionParserError("Invalid sizeof operation")
-                self.queue.append(len(self.cstruct.resolve(tmp_expression[i + 2])))
+                emit((OP_SIZEOF, tokens[i + 2]))
+                depth += 1
+                max_depth = max(max_depth, depth)
                 i += 3
             elif current_token in operators:
-                while (
-                    len(self.stack) != 0 and self.stack[-1] != "(" and (self.precedence(self.stack[-1], current_token))
-                ):
-                    self.evaluate_exp()
-                self.stack.append(current_token)
+                while stack and stack[-1] != "(" and prec[stack[-1]] >= prec[current_token]:
+                    pop_operator()
+                stack.append(current_token)
             elif current_token == "(":
                 if i > 0:
-                    previous_token = tmp_expression[i - 1]
-                    if self.is_number(previous_token):
+                    previous_token = tokens[i - 1]
+                    if "0" <= previous_token[0] <= "9":
                         raise ExpressionParserError(
                             f"Parser expected sizeof or an arethmethic operator instead got: '{previous_token}'"
                         )
 
-                self.stack.append(current_token)
+                stack.append(current_token)
             elif current_token == ")":
-                if i > 0:
-                    previous_token = tmp_expression[i - 1]
-                    if previous_token == "(":
-                        raise ExpressionParserError(
-                            f"Parser expected an expression, instead received empty parenthesis. Index: {i}"
-                        )
+                if i > 0 and tokens[i - 1] == "(":
+                    raise ExpressionParserError(
+                        f"Parser expected an expression, instead received empty parenthesis. Index: {i}"
+                    )
 
-                if len(self.stack) == 0:
-                    raise ExpressionParserError("Invalid expression")
+                while stack and stack[-1] != "(":
+                    pop_operator()
 
-                while self.stack[-1] != "(":
-                    self.evaluate_exp()
+                if not stack:
+                    raise ExpressionParserError("Invalid expression")
 
-                self.stack.pop(-1)
+                stack.pop()
             else:
-                raise ExpressionParserError(f"Unmatched token: '{current_token}'")
+                # Names are resolved from the context or constants during evaluation
+                emit((OP_NAME, current_token))
+                depth += 1
+                max_depth = max(max_depth, depth)
             i += 1
 
-        while len(self.stack) != 0:
-            if self.stack[-1] == "(":
+        while stack:
+            if stack[-1] == "(":
                 raise ExpressionParserError("Invalid expression")
 
-            self.evaluate_exp()
+            pop_operator()
 
-        if len(self.queue) != 1:
+        if depth != 1:
             raise ExpressionParserError("Invalid expression")
 
-        return self.queue[0]
+        # The evaluation stack never grows beyond the number of operands that are pending at the same time
+        self._max_stack = max_depth
+        return output
+
+    def evaluate(self, context: dict[str, int] | None = None) -> int:
+        """Evaluates the compiled postfix instructions of the expression."""
+        context_get = (_EMPTY_CONTEXT if context is None else context).get
+        consts_get = self.cstruct.consts.get
+
+        stack = [0] * self._max_stack
+        top = -1
+
+        for kind, value in self._postfix:
+            if kind == OP_LITERAL:
+                top += 1
+                stack[top] = value
+            elif kind == OP_NAME:
+                if (result := context_get(value)) is None and (result := consts_get(value)) is None:
+                    raise ExpressionParserError(f"Unmatched token: '{value}'")
+                top += 1
+                stack[top] = int(result)
+            elif kind == OP_BINARY:
+                right = stack[top]
+                top -= 1
+                stack[top] = value(stack[top], right)
+            elif kind == OP_NEGATE:
+                stack[top] = -stack[top]
+            elif kind == OP_INVERT:
+                stack[top] = ~stack[top]
+            else:
+                top += 1
+                stack[top] = self._sizeof(value)
+
+        return stack[0]
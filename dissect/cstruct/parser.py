@@ -2,6 +2,9 @@ from __future__ import annotations
 
 import ast
 import re
+import sys
+from bisect import bisect_left
+from itertools import accumulate
 from typing import TYPE_CHECKING
 
 from dissect.cstruct import compiler
@@ -10,11 +13,43 @@ from dissect.cstruct.exceptions import (
     ExpressionTokenizerError,
     ParserError,
 )
-from dissect.cstruct.expression import Expression
 from dissect.cstruct.types import ArrayMetaType, Field, MetaType
 
 if TYPE_CHECKING:
     from dissect.cstruct import cstruct
+    from dissect.cstruct.expression import Expression
+
+NAMED_GROUP_RE = re.compile(r"\(\?P<\w+>")
+NAME_REGEX = r"(?P<name>\**?\s*[a-zA-Z0-9_]+)(?:\s*:\s*(?P<bits>\d+))?(?:\[(?P<count>[^;\n]*)\])?\s*"
+# Field names outside of the definition, e.g. typedef names, don't have the ; the NAME token is followed by
+# Groups: name, bits, count
+FIELD_NAME_RE = re.compile(NAME_REGEX + r"\Z")
+# The characters that can start a comment or a quoted string
+COMMENT_OR_QUOTE_RE = re.compile(r"[\"'/]")
+# A single enum member with an optional value, members are separated by a comma or line break
+# Anything between two separators that isn't a valid member is matched as invalid, so matches are always consecutive
+# Groups: name, value, invalid
+ENUM_MEMBER_RE = re.compile(
+    r"[\s,]*(?:([a-zA-Z_][a-zA-Z0-9_]*)[^\S\r\n]*(?:=[^\S\r\n]*([^,\r\n]*?))?|([^\s,][^,\r\n]*?))\s*(?:,|\r|$)",
+    re.MULTILINE,
+)
+
+# Patterns of the legacy CStyleParser
+LEGACY_DEFINE_RE = re.compile(r"#define\s+(?P<name>[^\s]+)\s+(?P<value>[^\r\n]+)\s*\n")
+LEGACY_ENUM_RE = re.compile(
+    r"(?P<enumtype>enum|flag)\s+(?P<name>[^\s:{]+)\s*(:\s*(?P<type>[^\s]+)\s*)?\{(?P<values>[^}]+)\}\s*;"
+)
+LEGACY_STRUCT_RE = re.compile(
+    r"(#(?P<flags>(?:compile))\s+)?"
+    r"((?P<typedef>typedef)\s+)?"
+    r"(?P<type>[^\s]+)\s+"
+    r"(?P<name>[^\s]+)?"
+    r"(?P<fields>"
+    r"\s*{[^}]+\}(?P<defs>\s+[^;\n]+)?"
+    r")?\s*;"
+)
+LEGACY_FIELD_RE = re.compile(r"(?P<type>[^\s]+)\s+(?P<name>[^\s\[:]+)(:(?P<bits>\d+))?(\[(?P<count>[^;\n]*)\])?;")
+LEGACY_LOOKUP_RE = re.compile(r"\$(?P<name>[^\s]+) = ({[^}]+})\w*\n")
 
 
 class Parser:
@@ -26,6 +61,7 @@ class Parser:
 
     def __init__(self, cs: cstruct):
         self.cstruct = cs
+        self._resolve_cache: dict[str, MetaType] = {}
 
     def parse(self, data: str) -> None:
         """This function should parse definitions to cstruct types.
@@ -35,6 +71,16 @@ class Parser:
         """
         raise NotImplementedError()
 
+    def _resolve(self, name: str) -> MetaType:
+        """Resolve a type name, caching the result for the duration of a parse.
+
+        Types are only added while parsing, the parser never replaces a type, so a name that resolved once keeps
+        resolving to the same type.
+        """
+        if (type_ := self._resolve_cache.get(name)) is None:
+            type_ = self._resolve_cache[name] = self.cstruct.resolve(name)
+        return type_
+
 
 class TokenParser(Parser):
     """
@@ -49,6 +95,17 @@ class TokenParser(Parser):
         self.compiled = compiled
         self.align = align
         self.TOK = self._tokencollection()
+        self._wrapper_cache: dict[tuple, MetaType] = {}
+
+        # Handlers for the tokens that can start a top level definition
+        self._handlers = {
+            self.TOK.CONFIG_FLAG: self._config_flag,
+            self.TOK.DEFINE: self._constant,
+            self.TOK.TYPEDEF: self._typedef,
+            self.TOK.STRUCT: self._register_struct,
+            self.TOK.ENUM: self._enum,
+            self.TOK.LOOKUP: self._lookup,
+        }
 
     @staticmethod
     def _tokencollection() -> TokenCollection:
@@ -63,36 +120,48 @@ class TokenParser(Parser):
             "ENUM",
         )
         TOK.add(r"(?<=})\s*(?P<defs>(?:[a-zA-Z0-9_]+\s*,\s*)+[a-zA-Z0-9_]+)\s*(?=;)", "DEFS")
-        TOK.add(r"(?P<name>\**?\s*[a-zA-Z0-9_]+)(?:\s*:\s*(?P<bits>\d+))?(?:\[(?P<count>[^;\n]*)\])?\s*(?=;)", "NAME")
+        TOK.add(NAME_REGEX + r"(?=;)", "NAME")
         TOK.add(r"[a-zA-Z_][a-zA-Z0-9_]*", "IDENTIFIER")
         TOK.add(r"[{}]", "BLOCK")
         TOK.add(r"\$(?P<name>[^\s]+) = (?P<value>{[^}]+})\w*[\r\n]+", "LOOKUP")
         TOK.add(r";", "EOL")
         TOK.add(r"\s+", None)
         TOK.add(r".", None)
+        TOK.compile()
 
         return TOK
 
+    def _make_pointer(self, type_: MetaType) -> MetaType:
+        """Create a pointer type, reusing an earlier one for the same target type during a parse."""
+        key = (None, type_)
+        if (pointer := self._wrapper_cache.get(key)) is None:
+            pointer = self._wrapper_cache[key] = self.cstruct._make_pointer(type_)
+        return pointer
+
+    def _make_array(self, type_: MetaType, count: int | Expression | None) -> MetaType:
+        """Create an array type, reusing an earlier one for the same element type and count during a parse.
+
+        Count expressions are shared per expression string by the cstruct instance, so they can be part of the key.
+        """
+        key = (type_, count)
+        if (array := self._wrapper_cache.get(key)) is None:
+            array = self._wrapper_cache[key] = self.cstruct._make_array(type_, count)
+        return array
+
     def _identifier(self, tokens: TokenConsumer) -> str:
-        idents = []
-        while tokens.next == self.TOK.IDENTIFIER:
-            idents.append(tokens.consume())
-        return " ".join([i.value for i in idents])
+        return " ".join([token.value for token in tokens.consume_run(self.TOK.IDENTIFIER)])
 
     def _constant(self, tokens: TokenConsumer) -> None:
         const = tokens.consume()
-        pattern = self.TOK.patterns[self.TOK.DEFINE]
-        match = pattern.match(const.value).groupdict()
+        match = self.TOK.groupdict(const)
 
         value = match["value"]
         try:
             value = ast.literal_eval(value)
         except (ValueError, SyntaxError):
-            pass
-
-        if isinstance(value, str):
+            # Only values that aren't a Python literal can be an expression
             try:
-                value = Expression(self.cstruct, value).evaluate()
+                value = self.cstruct._make_expression(value).evaluate()
             except (ExpressionParserError, ExpressionTokenizerError):
                 pass
 
@@ -102,9 +171,7 @@ class TokenParser(Parser):
         # We cheat with enums because the entire enum is in the token
         etok = tokens.consume()
 
-        pattern = self.TOK.patterns[self.TOK.ENUM]
-        # Dirty trick because the regex expects a ; but we don't want it to be part of the value
-        d = pattern.match(etok.value + ";").groupdict()
+        d = self.TOK.groupdict(etok)
         enumtype = d["enumtype"]
 
         nextval = 0
@@ -112,46 +179,43 @@ class TokenParser(Parser):
             nextval = 1
 
         values = {}
-        for line in d["values"].splitlines():
-            for v in line.split(","):
-                key, _, val = v.partition("=")
-                key = key.strip()
-                val = val.strip()
-                if not key:
-                    continue
-                if not val:
-                    val = nextval
-                else:
-                    val = Expression(self.cstruct, val).evaluate(values)
+        for key, val, invalid in ENUM_MEMBER_RE.findall(d["values"]):
+            if invalid:
+                raise ParserError(f"line {tokens.lineno(etok)}: invalid enum member {invalid!r}")
 
-                if enumtype == "flag":
-                    high_bit = val.bit_length() - 1
-                    nextval = 2 ** (high_bit + 1)
-                else:
-                    nextval = val + 1
+            if not val:
+                val = nextval
+            else:
+                val = self.cstruct._make_expression(val).evaluate(values)
+
+            if enumtype == "flag":
+                high_bit = val.bit_length() - 1
+                nextval = 2 ** (high_bit + 1)
+            else:
+                nextval = val + 1
 
-                values[key] = val
+            values[key] = val
 
         if not d["type"]:
             d["type"] = "uint32"
 
         factory = self.cstruct._make_flag if enumtype == "flag" else self.cstruct._make_enum
 
-        enum = factory(d["name"] or "", self.cstruct.resolve(d["type"]), values)
+        enum = factory(d["name"] or "", self._resolve(d["type"]), values)
         if not enum.__name__:
             self.cstruct.consts.update(enum.__members__)
         else:
             self.cstruct.add_type(enum.__name__, enum)
 
-        tokens.eol()
+        tokens.expect(self.TOK.EOL)
 
     def _typedef(self, tokens: TokenConsumer) -> None:
         tokens.consume()
         type_ = None
 
-        if tokens.next == self.TOK.IDENTIFIER:
-            type_ = self.cstruct.resolve(self._identifier(tokens))
-        elif tokens.next == self.TOK.STRUCT:
+        if tokens.next_kind is self.TOK.IDENTIFIER:
+            type_ = self._resolve(self._identifier(tokens))
+        elif tokens.next_kind is self.TOK.STRUCT:
             # The register thing is a bit dirty
             # Basically consumes all NAME tokens and
             # registers the struct
@@ -161,7 +225,7 @@ class TokenParser(Parser):
         for name in names:
             type_, name, bits = self._parse_field_type(type_, name)
             if bits is not None:
-                raise ParserError(f"line {self._lineno(tokens.previous)}: typedefs cannot have bitfields")
+                raise ParserError(f"line {tokens.lineno(tokens.previous)}: typedefs cannot have bitfields")
             self.cstruct.add_type(name, type_)
 
     def _struct(self, tokens: TokenConsumer, register: bool = False) -> None:
@@ -173,7 +237,7 @@ class TokenParser(Parser):
         names = []
         registered = False
 
-        if tokens.next == self.TOK.IDENTIFIER:
+        if tokens.next_kind is self.TOK.IDENTIFIER:
             ident = tokens.consume()
             if register:
                 # Pre-register an empty struct for self-referencing
@@ -186,20 +250,20 @@ class TokenParser(Parser):
             else:
                 names.append(ident.value)
 
-        if tokens.next == self.TOK.NAME:
+        if tokens.next_kind is self.TOK.NAME:
             # As part of a struct field
             # struct type_name field_name;
             if not len(names):
-                raise ParserError(f"line {self._lineno(tokens.next)}: unexpected anonymous struct")
-            return self.cstruct.resolve(names[0])
+                raise ParserError(f"line {tokens.lineno(tokens.next)}: unexpected anonymous struct")
+            return self._resolve(names[0])
 
-        if tokens.next != self.TOK.BLOCK:
-            raise ParserError(f"line {self._lineno(tokens.next)}: expected start of block '{tokens.next}'")
+        if tokens.next_kind is not self.TOK.BLOCK:
+            raise ParserError(f"line {tokens.lineno(tokens.next)}: expected start of block '{tokens.next}'")
 
         fields = []
         tokens.consume()
         while len(tokens):
-            if tokens.next == self.TOK.BLOCK and tokens.next.value == "}":
+            if tokens.next_kind is self.TOK.BLOCK and tokens.next.value == "}":
                 tokens.consume()
                 break
 
@@ -227,7 +291,7 @@ class TokenParser(Parser):
         # This is pretty dirty
         if register:
             if not names and not registered:
-                raise ParserError(f"line {self._lineno(stype)}: struct has no name")
+                raise ParserError(f"line {tokens.lineno(stype)}: struct has no name")
 
             for name in names:
                 self.cstruct.add_type(name, st)
@@ -235,60 +299,51 @@ class TokenParser(Parser):
         tokens.reset_flags()
         return st
 
+    def _register_struct(self, tokens: TokenConsumer) -> None:
+        self._struct(tokens, register=True)
+
     def _lookup(self, tokens: TokenConsumer) -> None:
         # Just like enums, we cheat and have the entire lookup in the token
         ltok = tokens.consume()
 
-        pattern = self.TOK.patterns[self.TOK.LOOKUP]
-        # Dirty trick because the regex expects a ; but we don't want it to be part of the value
-        m = pattern.match(ltok.value + ";")
-        d = ast.literal_eval(m.group(2))
-        self.cstruct.lookups[m.group(1)] = dict([(self.cstruct.consts[k], v) for k, v in d.items()])
+        m = self.TOK.groupdict(ltok)
+        d = ast.literal_eval(m["value"])
+        self.cstruct.lookups[m["name"]] = dict([(self.cstruct.consts[k], v) for k, v in d.items()])
 
     def _parse_field(self, tokens: TokenConsumer) -> Field:
         type_ = None
-        if tokens.next == self.TOK.IDENTIFIER:
-            type_ = self.cstruct.resolve(self._identifier(tokens))
-        elif tokens.next == self.TOK.STRUCT:
+        if tokens.next_kind is self.TOK.IDENTIFIER:
+            type_ = self._resolve(self._identifier(tokens))
+        elif tokens.next_kind is self.TOK.STRUCT:
             type_ = self._struct(tokens)
 
-            if tokens.next != self.TOK.NAME:
+            if tokens.next_kind is not self.TOK.NAME:
                 type_, name, bits = self._parse_field_type(type_, type_.__name__)
-                return Field(name.strip(), type_, bits)
+                return Field(name, type_, bits)
 
-        if tokens.next != self.TOK.NAME:
-            raise ParserError(f"line {self._lineno(tokens.next)}: expected name")
+        if tokens.next_kind is not self.TOK.NAME:
+            raise ParserError(f"line {tokens.lineno(tokens.next)}: expected name")
         nametok = tokens.consume()
 
         type_, name, bits = self._parse_field_type(type_, nametok.value)
 
-        tokens.eol()
-        return Field(name.strip(), type_, bits)
+        tokens.expect(self.TOK.EOL)
+        return Field(name, type_, bits)
 
     def _parse_field_type(self, type_: MetaType, name: str) -> tuple[MetaType, str, int | None]:
-        pattern = self.TOK.patterns[self.TOK.NAME]
-        # Dirty trick because the regex expects a ; but we don't want it to be part of the value
-        d = pattern.match(name + ";").groupdict()
-
-        name = d["name"]
-        count_expression = d["count"]
+        name, bits, count_expression = FIELD_NAME_RE.match(name).groups()
 
         while name.startswith("*"):
             name = name[1:]
-            type_ = self.cstruct._make_pointer(type_)
+            type_ = self._make_pointer(type_)
 
         if count_expression is not None:
             # Poor mans multi-dimensional array by abusing the eager regex match of count
-            if "][" in count_expression:
-                counts = count_expression.split("][")
-            else:
-                counts = [count_expression]
-
-            for count in reversed(counts):
-                if count == "":
+            for count in reversed(count_expression.split("][")):
+                if not count:
                     count = None
                 else:
-                    count = Expression(self.cstruct, count)
+                    count = self.cstruct._make_expression(count)
                     try:
                         count = count.evaluate()
                     except Exception:
@@ -297,89 +352,148 @@ class TokenParser(Parser):
                 if isinstance(type_, ArrayMetaType) and count is None:
                     raise ParserError("Depth required for multi-dimensional array")
 
-                type_ = self.cstruct._make_array(type_, count)
+                type_ = self._make_array(type_, count)
 
-        return type_, name.strip(), int(d["bits"]) if d["bits"] else None
+        # Field and type names recur a lot across definitions, so intern them
+        return type_, sys.intern(name.strip()), int(bits) if bits else None
 
     def _names(self, tokens: TokenConsumer) -> list[str]:
+        TOK_NAME, TOK_DEFS, TOK_EOL = self.TOK.NAME, self.TOK.DEFS, self.TOK.EOL
+
+        # Usually there's no name or a single name followed by the EOL, so peek at every token only once
         names = []
         while True:
-            if tokens.next == self.TOK.EOL:
-                tokens.eol()
+            kind = tokens.next_kind
+            if kind is TOK_EOL:
+                tokens.consume()
                 break
 
-            if tokens.next not in (self.TOK.NAME, self.TOK.DEFS):
+            if kind is TOK_NAME:
+                names.append(sys.intern(tokens.consume().value.strip()))
+            elif kind is TOK_DEFS:
+                names.extend(sys.intern(name.strip()) for name in tokens.consume().value.split(","))
+            else:
                 break
 
-            ntoken = tokens.consume()
-            if ntoken == self.TOK.NAME:
-                names.append(ntoken.value.strip())
-            elif ntoken == self.TOK.DEFS:
-                for name in ntoken.value.strip().split(","):
-                    names.append(name.strip())
-
         return names
 
     @staticmethod
     def _remove_comments(string: str) -> str:
-        # https://stackoverflow.com/a/18381470
-        pattern = r"(\".*?\"|\'.*?\')|(/\*.*?\*/|//[^\r\n]*$)"
-        # first group captures quoted strings (double or single)
-        # second group captures comments (//single-line or /* multi-line */)
-        regex = re.compile(pattern, re.MULTILINE | re.DOTALL)
-
-        def _replacer(match: re.Match) -> str:
-            # if the 2nd group (capturing comments) is not None,
-            # it means we have captured a non-quoted (real) comment string.
-            if comment := match.group(2):
-                return "\n" * comment.count("\n")  # so we will return empty to remove the comment
-            else:  # otherwise, we will return the 1st group
-                return match.group(1)  # captured quoted-string
-
-        return regex.sub(_replacer, string)
+        """Remove ``//`` and ``/* */`` comments that aren't inside a quoted string.
+
+        Multi-line comments are replaced with the newlines they contained to preserve line numbers. Instead of
+        matching a regex at every position, we jump to the next quote or slash and handle it from there.
+        """
+        if "//" not in string and "/*" not in string:
+            # Nothing to remove, e.g. generated definitions
+            return string
+
+        search = COMMENT_OR_QUOTE_RE.search
+        find = string.find
+        result = []
+
+        # Remember the next comment end, newline and carriage return, so we only search for them again once we've
+        # passed them, and never again once there are none left
+        comment_end = find("*/")
+        newline = find("\n")
+        carriage_return = find("\r")
+
+        pos = 0
+        while (match := search(string, pos)) is not None:
+            start = match.start()
+            char = match.group()
+            end = -1
+
+            if char == "/":
+                next_char = string[start + 1 : start + 2]
+                if next_char == "*":
+                    if 0 <= comment_end < start + 2:
+                        comment_end = find("*/", start + 2)
+                    if comment_end != -1:
+                        end = comment_end + 2
+                elif next_char == "/":
+                    if 0 <= newline < start:
+                        newline = find("\n", start)
+                    if 0 <= carriage_return < start:
+                        carriage_return = find("\r", start)
+
+                    # A single line comment has to end at a newline or the end of the data
+                    end = newline if newline != -1 else len(string)
+                    if carriage_return != -1 and carriage_return < end:
+                        end = -1
+
+                if end != -1:
+                    result.append(string[pos:start])
+                    result.append("\n" * string.count("\n", start, end))
+                    pos = end
+                    continue
+            else:
+                # Quoted strings are kept as is
+                if (end := find(char, start + 1)) != -1:
+                    result.append(string[pos : end + 1])
+                    pos = end + 1
+                    continue
+
+            # Not a comment or a closed quoted string, continue after this character
+            result.append(string[pos : start + 1])
+            pos = start + 1
+
+        result.append(string[pos:])
+        return "".join(result)
 
     @staticmethod
-    def _lineno(tok: Token) -> int:
-        """Quick and dirty line number calculator"""
+    def _lineno(tok: Token, newline_offsets: list[int] | None = None) -> int:
+        """Quick and dirty line number calculator
+
+        Uses a bisect if the offsets of all newlines in the parsed data are given.
+        """
 
         match = tok.match
-        return match.string.count("\n", 0, match.start()) + 1
+        if newline_offsets is None:
+            return match.string.count("\n", 0, match.start()) + 1
+        return bisect_left(newline_offsets, match.start()) + 1
 
     def _config_flag(self, tokens: TokenConsumer) -> None:
         flag_token = tokens.consume()
-        pattern = self.TOK.patterns[self.TOK.CONFIG_FLAG]
-        tok_dict = pattern.match(flag_token.value).groupdict()
+        tok_dict = self.TOK.groupdict(flag_token)
         tokens.flags.extend(tok_dict["values"].split(","))
 
-    def parse(self, data: str) -> None:
-        scanner = re.Scanner(self.TOK.tokens)
-        data = self._remove_comments(data)
-        tokens, remaining = scanner.scan(data)
+    def _tokenize(self, data: str) -> list[Token]:
+        """Split the data into tokens, skipping whitespace and other tokens without a kind."""
+        kinds = self.TOK.kinds
+
+        tokens = []
+        pos = 0
+        for match in self.TOK.master.finditer(data):
+            # Tokens have to be adjacent, a gap means some part of the data didn't match any token
+            if match.start() != pos:
+                break
+            pos = match.end()
+
+            if (kind := kinds[match.lastindex]) is not None:
+                tokens.append(Token(kind, match.group(), match))
 
-        if len(remaining):
-            lineno = data.count("\n", 0, len(data) - len(remaining))
+        if pos != len(data):
+            lineno = data.count("\n", 0, pos)
             raise ParserError(f"line {lineno}: invalid syntax in definition")
 
-        tokens = TokenConsumer(tokens)
+        return tokens
+
+    def parse(self, data: str) -> None:
+        self._resolve_cache = {}
+        self._wrapper_cache = {}
+        data = self._remove_comments(data)
+
+        tokens = TokenConsumer(self._tokenize(data))
+        handlers = self._handlers
         while True:
             token = tokens.next
             if token is None:
                 break
 
-            if token == self.TOK.CONFIG_FLAG:
-                self._config_flag(tokens)
-            elif token == self.TOK.DEFINE:
-                self._constant(tokens)
-            elif token == self.TOK.TYPEDEF:
-                self._typedef(tokens)
-            elif token == self.TOK.STRUCT:
-                self._struct(tokens, register=True)
-            elif token == self.TOK.ENUM:
-                self._enum(tokens)
-            elif token == self.TOK.LOOKUP:
-                self._lookup(tokens)
-            else:
-                raise ParserError(f"line {self._lineno(token)}: unexpected token {token!r}")
+            if (handler := handlers.get(token.token)) is None:
+                raise ParserError(f"line {tokens.lineno(token)}: unexpected token {token!r}")
+            handler(tokens)
 
 
 class CStyleParser(Parser):
@@ -395,7 +509,7 @@ class CStyleParser(Parser):
         super().__init__(cs)
 
     def _constants(self, data: str) -> None:
-        r = re.finditer(r"#define\s+(?P<name>[^\s]+)\s+(?P<value>[^\r\n]+)\s*\n", data)
+        r = LEGACY_DEFINE_RE.finditer(data)
         for t in r:
             d = t.groupdict()
             v = d["value"].rsplit("//")[0]
@@ -408,10 +522,7 @@ class CStyleParser(Parser):
             self.cstruct.consts[d["name"]] = v
 
     def _enums(self, data: str) -> None:
-        r = re.finditer(
-            r"(?P<enumtype>enum|flag)\s+(?P<name>[^\s:{]+)\s*(:\s*(?P<type>[^\s]+)\s*)?\{(?P<values>[^}]+)\}\s*;",
-            data,
-        )
+        r = LEGACY_ENUM_RE.finditer(data)
         for t in r:
             d = t.groupdict()
             enumtype = d["enumtype"]
@@ -432,7 +543,7 @@ class CStyleParser(Parser):
                     if not val:
                         val = nextval
                     else:
-                        val = Expression(self.cstruct, val).evaluate()
+                        val = self.cstruct._make_expression(val).evaluate()
 
                     if enumtype == "flag":
                         high_bit = val.bit_length() - 1
@@ -449,20 +560,11 @@ class CStyleParser(Parser):
             if enumtype == "flag":
                 factory = self.cstruct._make_flag
 
-            enum = factory(d["name"], self.cstruct.resolve(d["type"]), values)
+            enum = factory(d["name"], self._resolve(d["type"]), values)
             self.cstruct.add_type(enum.__name__, enum)
 
     def _structs(self, data: str) -> None:
-        r = re.finditer(
-            r"(#(?P<flags>(?:compile))\s+)?"
-            r"((?P<typedef>typedef)\s+)?"
-            r"(?P<type>[^\s]+)\s+"
-            r"(?P<name>[^\s]+)?"
-            r"(?P<fields>"
-            r"\s*{[^}]+\}(?P<defs>\s+[^;\n]+)?"
-            r")?\s*;",
-            data,
-        )
+        r = LEGACY_STRUCT_RE.finditer(data)
         for t in r:
             d = t.groupdict()
 
@@ -492,10 +594,7 @@ class CStyleParser(Parser):
                     self.cstruct.add_type(td, st)
 
     def _parse_fields(self, data: str) -> None:
-        fields = re.finditer(
-            r"(?P<type>[^\s]+)\s+(?P<name>[^\s\[:]+)(:(?P<bits>\d+))?(\[(?P<count>[^;\n]*)\])?;",
-            data,
-        )
+        fields = LEGACY_FIELD_RE.finditer(data)
 
         result = []
         for f in fields:
@@ -503,7 +602,7 @@ class CStyleParser(Parser):
             if d["type"].startswith("//"):
                 continue
 
-            type_ = self.cstruct.resolve(d["type"])
+            type_ = self._resolve(d["type"])
 
             d["name"] = d["name"].replace("(", "").replace(")", "")
 
@@ -513,7 +612,7 @@ class CStyleParser(Parser):
                 if d["count"] == "":
                     count = None
                 else:
-                    count = Expression(self.cstruct, d["count"])
+                    count = self.cstruct._make_expression(d["count"])
                     try:
                         count = count.evaluate()
                     except Exception:
@@ -531,13 +630,14 @@ class CStyleParser(Parser):
         return result
 
     def _lookups(self, data: str, consts: dict[str, int]) -> None:
-        r = re.finditer(r"\$(?P<name>[^\s]+) = ({[^}]+})\w*\n", data)
+        r = LEGACY_LOOKUP_RE.finditer(data)
 
         for t in r:
             d = ast.literal_eval(t.group(2))
             self.cstruct.lookups[t.group(1)] = dict([(self.cstruct.consts[k], v) for k, v in d.items()])
 
     def parse(self, data: str) -> None:
+        self._resolve_cache = {}
         self._constants(data)
         self._enums(data)
         self._structs(data)
@@ -552,72 +652,123 @@ class Token:
         self.value = value
         self.match = match
 
-    def __eq__(self, other):
-        if isinstance(other, Token):
-            other = other.token
-
-        return self.token == other
-
-    def __ne__(self, other):
-        return not self == other
-
     def __repr__(self):
         return f"<Token.{self.token} value={self.value!r}>"
 
 
 class TokenCollection:
     def __init__(self):
-        self.tokens: list[Token] = []
-        self.lookup: dict[str, str] = {}
+        self.tokens: list[tuple[str, str | None]] = []
         self.patterns: dict[str, re.Pattern] = {}
-
-    def __getattr__(self, attr: str):
-        try:
-            return self.lookup[attr]
-        except AttributeError:
-            pass
-
-        return object.__getattribute__(self, attr)
+        self.master: re.Pattern | None = None
+        self.kinds: list[str | None] = []
+        self.groups: dict[str, dict[str, int]] = {}
 
     def add(self, regex: str, name: str) -> None:
-        if name is None:
-            self.tokens.append((regex, None))
-        else:
-            self.lookup[name] = name
+        if name is not None:
+            # Token kinds are interned so the parser can compare them by identity
+            name = sys.intern(name)
+            # Token kinds are accessible as attributes, e.g. TOK.NAME == "NAME"
+            setattr(self, name, name)
             self.patterns[name] = re.compile(regex)
-            self.tokens.append((regex, lambda s, t: Token(name, t, s.match)))
+        self.tokens.append((regex, name))
+
+    def compile(self) -> None:
+        """Combine all token regexes into a single pattern that matches any of the tokens.
+
+        Every token regex is wrapped in a capturing group, so ``match.lastindex`` of a match of the combined pattern
+        indexes ``kinds`` to get the name of the matched token.
+        """
+        alternatives = []
+        kinds = [None]
+        for regex, name in self.tokens:
+            if name is not None:
+                # Remember where the named groups of the token regex end up in the combined pattern
+                base = len(kinds)
+                self.groups[name] = {group: base + idx for group, idx in self.patterns[name].groupindex.items()}
+
+            # Group names can only occur once per pattern, unnamed groups keep the group numbering intact
+            regex = NAMED_GROUP_RE.sub("(", regex)
+            alternatives.append(f"({regex})")
+            kinds.append(name)
+            kinds.extend([None] * re.compile(regex).groups)
+
+        self.master = re.compile("|".join(alternatives))
+        self.kinds = kinds
+
+    def groupdict(self, token: Token) -> dict[str, str | None]:
+        """Return the named groups of the token regex, as they were matched during tokenization."""
+        match = token.match
+        return {group: match.group(idx) for group, idx in self.groups[token.token].items()}
 
 
 class TokenConsumer:
     def __init__(self, tokens: list[Token]):
         self.tokens = tokens
+        self.pos = 0
         self.flags = []
         self.previous = None
+        self._newline_offsets: list[int] | None = None
 
-    def __contains__(self, token: Token) -> bool:
-        return token in self.tokens
+    def __contains__(self, token: Token | str) -> bool:
+        kind = token.token if isinstance(token, Token) else token
+        return any(tok.token == kind for tok in self.tokens[self.pos :])
 
     def __len__(self) -> int:
-        return len(self.tokens)
+        return len(self.tokens) - self.pos
 
     def __repr__(self) -> str:
         return f"<TokenConsumer next={self.next!r}>"
 
     @property
     def next(self) -> Token:
-        try:
-            return self.tokens[0]
-        except IndexError:
-            return None
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return None
+
+    @property
+    def next_kind(self) -> str | None:
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos].token
+        return None
 
     def consume(self) -> Token:
-        self.previous = self.tokens.pop(0)
+        # Tokens are consumed by moving the cursor, popping from the front of the list would be O(n) per token
+        self.previous = self.tokens[self.pos]
+        self.pos += 1
         return self.previous
 
+    def consume_run(self, kind: str) -> list[Token]:
+        """Consume all consecutive tokens of the given kind in one go."""
+        tokens = self.tokens
+        start = end = self.pos
+        while end < len(tokens) and tokens[end].token is kind:
+            end += 1
+
+        if end != start:
+            self.previous = tokens[end - 1]
+            self.pos = end
+        return tokens[start:end]
+
+    def lineno(self, token: Token) -> int:
+        """Return the line number of a token, the newline offsets are only computed once per parse."""
+        if self._newline_offsets is None:
+            string = token.match.string
+            self._newline_offsets = list(accumulate((len(line) + 1 for line in string.split("\n")), initial=-1))[1:-1]
+        return TokenParser._lineno(token, self._newline_offsets)
+
     def reset_flags(self) -> None:
         self.flags = []
 
-    def eol(self) -> None:
-        token = self.consume()
-        if token.token != "EOL":
-            raise ParserError(f"line {self._lineno(token)}: expected EOL")
+    def expect(self, kind: str) -> None:
+        """Consume the next token, which has to be of the given kind."""
+        if self.pos >= len(self.tokens):
+            line = f"line {self.lineno(self.previous)}: " if self.previous is not None else ""
+            raise ParserError(f"{line}expected {kind}")
+
+        token = self.tokens[self.pos]
+        if token.token is not kind:
+            raise ParserError(f"line {self.lineno(token)}: expected {kind}")
+
+        self.previous = token
+        self.pos += 1
@@ -33,17 +33,25 @@ class MetaType(type):
     def __call__(cls, *args, **kwargs) -> MetaType | BaseType:
         """Adds support for ``TypeClass(bytes | file-like object)`` parsing syntax."""
         # TODO: add support for Type(cs) API to create new bounded type classes, similar to the old API?
-        if len(args) == 1 and not isinstance(args[0], cls):
+        if len(args) == 1:
             stream = args[0]
+            stream_type = type(stream)
 
-            if _is_readable_type(stream):
+            if stream_type is bytes or stream_type is bytearray or stream_type is memoryview:
+                # Fast path for the common buffer types, these can never be an instance of a type class
+                is_buffer = True
+            elif isinstance(stream, cls):
+                return type.__call__(cls, *args, **kwargs)
+            elif _is_readable_type(stream):
                 return cls._read(stream)
+            else:
+                is_buffer = _is_buffer_type(stream)
 
             if issubclass(cls, bytes) and isinstance(stream, bytes) and len(stream) == cls.size:
                 # Shortcut for char/bytes type
                 return type.__call__(cls, *args, **kwargs)
 
-            if _is_buffer_type(stream):
+            if is_buffer:
                 return cls.reads(stream)
 
         return type.__call__(cls, *args, **kwargs)
@@ -2,7 +2,7 @@ from __future__ import annotations
 
 from typing import Any, BinaryIO
 
-from dissect.cstruct.types.base import BaseType
+from dissect.cstruct.types.base import EOF, BaseType
 from dissect.cstruct.utils import ENDIANNESS_MAP
 
 
@@ -20,6 +20,24 @@ class Int(int, BaseType):
 
         return cls.from_bytes(data, ENDIANNESS_MAP[cls.cs.endian], signed=cls.signed)
 
+    @classmethod
+    def _read_array(cls, stream: BinaryIO, count: int, context: dict[str, Any] | None = None) -> list[Int]:
+        size = cls.size
+        if count == EOF:
+            data = stream.read()
+            length = len(data) - len(data) % size
+        else:
+            length = size * count
+            data = stream.read(length)
+
+            if len(data) != length:
+                raise EOFError(f"Read {len(data)} bytes, but expected {length}")
+
+        from_bytes = cls.from_bytes
+        endian = ENDIANNESS_MAP[cls.cs.endian]
+        signed = cls.signed
+        return [from_bytes(data[offset : offset + size], endian, signed=signed) for offset in range(0, length, size)]
+
     @classmethod
     def _read_0(cls, stream: BinaryIO, context: dict[str, Any] | None = None) -> Int:
         result = []
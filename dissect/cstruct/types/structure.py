@@ -24,6 +24,8 @@ from dissect.cstruct.types.pointer import Pointer
 class Field:
     """Structure field."""
 
+    __slots__ = ("name", "type", "bits", "offset", "alignment")
+
     def __init__(self, name: str, type_: MetaType, bits: int = None, offset: int = None):
         self.name = name
         self.type = type_
@@ -58,6 +58,7 @@ def test_constants(cs: cstruct) -> None:
     #define b 0x2
     #define c "test"
     #define d 1 << 1
+    #define e "a"
     """
     cs.load(cdef)
 
@@ -65,6 +66,7 @@ def test_constants(cs: cstruct) -> None:
     assert cs.b == 2
     assert cs.c == "test"
     assert cs.d == 2
+    assert cs.e == "a"
 
 
 def test_duplicate_types(cs: cstruct) -> None:
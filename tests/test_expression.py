@@ -52,6 +52,8 @@ testdata = [
     ("4 * 1 + 1", 5),
     ("-42", -42),
     ("42 + (-42)", 0),
+    ("2 - -1", 3),
+    ("-A * -2", 16),
     ("A + 5", 13),
     ("21 - B", 8),
     ("A + B", 21),
@@ -64,6 +66,13 @@ testdata = [
     ("0Xf0 >> 4", 0xF),
     ("0x1B", 0x1B),
     ("0x1b", 0x1B),
+    ("0x10UL + 1lu", 0x11),
+    ("017 + 0", 15),
+    ("0777l", 0o777),
+    ("long_identifier_name_1 * 2", 84),
+    ("u - 1", 2),
+    ("-u", -3),
+    ("u * -u", -9),
 ]
 
 
@@ -71,6 +80,8 @@ class Consts:
     consts = {
         "A": 8,
         "B": 13,
+        "long_identifier_name_1": 42,
+        "u": 3,
     }
 
 
@@ -90,10 +101,17 @@ def test_expression(expression: str, answer: int) -> None:
     [
         ("0b", ExpressionTokenizerError, "Invalid binary or hex notation"),
         ("0x", ExpressionTokenizerError, "Invalid binary or hex notation"),
+        ("08", ExpressionTokenizerError, "Invalid number notation '08'"),
+        ("0b12", ExpressionTokenizerError, "Invalid number notation '0b12'"),
+        ("019", ExpressionTokenizerError, "Invalid number notation '019'"),
+        ("1f + 1", ExpressionTokenizerError, "Invalid number notation '1f'"),
         ("$", ExpressionTokenizerError, "Tokenizer does not recognize following token '\\$'"),
+        ("1 > 2", ExpressionTokenizerError, "Tokenizer does not recognize following token '>'"),
+        ("1 <", ExpressionTokenizerError, "Tokenizer does not recognize following token '<'"),
         ("-", ExpressionParserError, "Invalid expression: not enough operands"),
         ("(", ExpressionParserError, "Invalid expression"),
         (")", ExpressionParserError, "Invalid expression"),
+        ("1 + 2)", ExpressionParserError, "Invalid expression"),
         (" ", ExpressionParserError, "Invalid expression"),
         ("()", ExpressionParserError, "Parser expected an expression, instead received empty parenthesis. Index: 1"),
         ("0()", ExpressionParserError, "Parser expected sizeof or an arethmethic operator instead got: '0'"),
@@ -107,6 +125,13 @@ def test_expression_failure(expression: str, exception: type, message: str) -> N
         parser.evaluate()
 
 
+@pytest.mark.parametrize("expression", ["sizeof)", "sizeof(uint8", "0()", "()", "1 + 2)"])
+def test_expression_failure_on_compile(expression: str) -> None:
+    # Syntax errors are raised when the expression is compiled, not when it is evaluated
+    with pytest.raises(ExpressionParserError):
+        Expression(Consts(), expression)
+
+
 def test_sizeof(cs: cstruct) -> None:
     d = """
     struct test {
@@ -121,3 +146,85 @@ def test_sizeof(cs: cstruct) -> None:
 
     assert len(cs.test) == 4
     assert len(cs.test2) == 8
+
+
+def test_sizeof_folded(cs: cstruct) -> None:
+    expression = Expression(cs, "sizeof(uint32) * 2")
+    assert expression.tokens == ["4", "*", "2"]
+    assert expression.evaluate() == 8
+
+    expression = Expression(cs, "sizeof(test) + 1")
+    assert "sizeof" in expression.tokens
+
+    cs.load("struct test { uint16 a; };")
+    assert expression.evaluate() == 3
+    assert expression._sizeof_cache == {"test": 2}
+
+
+def test_single_token() -> None:
+    assert Expression(Consts(), "0x10").evaluate() == 16
+    assert Expression(Consts(), "A").evaluate() == 8
+    assert Expression(Consts(), "A").evaluate({"A": 1}) == 1
+    assert Expression(Consts(), "C").evaluate({"C": 3}) == 3
+
+    with pytest.raises(ExpressionParserError, match="Unmatched token: 'C'"):
+        Expression(Consts(), "C").evaluate()
+
+
+def test_single_sizeof(cs: cstruct) -> None:
+    expression = Expression(cs, "sizeof(test)")
+    assert expression.evaluate == expression._evaluate_sizeof
+
+    cs.load("struct test { uint32 a; };")
+    assert expression.evaluate() == 4
+
+
+def test_constant_folding(cs: cstruct) -> None:
+    expression = Expression(cs, "sizeof(uint16) * (1 << 4) + 2")
+    assert not expression._needs_context
+    assert expression._const_value == 34
+    assert expression.evaluate() == 34
+
+    expression = Expression(cs, "A + 1")
+    assert expression._needs_context
+    assert expression._const_value is None
+
+    expression = Expression(cs, "1 / 0")
+    assert expression._const_value is None
+    with pytest.raises(ZeroDivisionError):
+        expression.evaluate()
+
+
+def test_expression_cache(cs: cstruct) -> None:
+    expression = cs._make_expression("A * 2")
+    assert expression is cs._make_expression("A * 2")
+    assert expression._max_stack == 2
+    assert expression.evaluate({"A": 2}) == 4
+    assert expression.evaluate({"A": 3}) == 6
+
+
+def test_expression_cache_replace_type(cs: cstruct) -> None:
+    cs.add_type("test", "uint16")
+    assert cs._make_expression("sizeof(test)").evaluate() == 2
+
+    cs.add_type("test", "uint32", replace=True)
+    assert cs._make_expression("sizeof(test)").evaluate() == 4
+
+
+def test_expression_cache_add_field(cs: cstruct) -> None:
+    cs.load("struct T { uint8 a; }; struct U { char x[sizeof(T)]; };")
+    assert len(cs.U) == 1
+
+    cs.T.add_field("b", cs.uint32)
+    cs.load("struct V { char x[sizeof(T)]; };")
+    assert len(cs.V) == 5
+
+
+def test_identifier_u(cs: cstruct) -> None:
+    # An identifier named u must not be mistaken for a unary minus
+    cs.load("#define u 4\nstruct S { char x[u]; };")
+    assert len(cs.S) == 4
+
+    cs = cstruct()
+    cs.load("struct t1 { uint8 u; char d[u]; };")
+    assert cs.t1(b"\x02ab").d == b"ab"
@@ -1,10 +1,11 @@
+import time
 from unittest.mock import Mock
 
 import pytest
 
 from dissect.cstruct import cstruct
 from dissect.cstruct.exceptions import ParserError
-from dissect.cstruct.parser import TokenParser
+from dissect.cstruct.parser import TokenConsumer, TokenParser
 from dissect.cstruct.types import ArrayMetaType, Pointer
 
 
@@ -89,3 +90,132 @@ def test_dynamic_substruct_size(cs: cstruct) -> None:
 
     assert cs.sub.dynamic
     assert cs.test.dynamic
+
+
+def test_tokenize(cs: cstruct) -> None:
+    parser = TokenParser(cs)
+    data = "#define A 1\nstruct test { uint32 a[A]; };"
+
+    tokens = [(token.token, token.value) for token in parser._tokenize(data)]
+    assert tokens == [
+        ("DEFINE", "#define A 1\n"),
+        ("STRUCT", "struct"),
+        ("IDENTIFIER", "test"),
+        ("BLOCK", "{"),
+        ("IDENTIFIER", "uint32"),
+        ("NAME", " a[A]"),
+        ("EOL", ";"),
+        ("BLOCK", "}"),
+        ("EOL", ";"),
+    ]
+
+
+def test_shared_expressions(cs: cstruct) -> None:
+    cdef = """
+    struct test {
+        uint8 len;
+        char a[len];
+        char b[len];
+    };
+    """
+    cs.load(cdef)
+
+    fields = cs.test.__fields__
+    assert fields[1].type.num_entries is fields[2].type.num_entries
+
+
+def test_shared_wrapper_types(cs: cstruct) -> None:
+    cdef = """
+    struct test {
+        uint8 a[4];
+        uint8 b[4];
+        uint8 c[2];
+        uint8 *d;
+        uint8 *e;
+    };
+    """
+    cs.load(cdef, compiled=False)
+
+    fields = cs.test.__fields__
+    assert fields[0].type is fields[1].type
+    assert fields[0].type is not fields[2].type
+    assert fields[3].type is fields[4].type
+
+    obj = cs.test(b"\x01\x02\x03\x04\x05\x06\x07\x08\x09\x0a" + b"\x00" * (cs.pointer.size * 2))
+    assert obj.a == [1, 2, 3, 4]
+    assert obj.b == [5, 6, 7, 8]
+    assert obj.c == [9, 10]
+
+
+def test_remove_comments() -> None:
+    cdef = """
+    #define A "a // b"// comment
+    #define B '/* c */'/* comment */
+    #define C 1 /* unterminated
+    """
+    expected = """
+    #define A "a // b"
+    #define B '/* c */'
+    #define C 1 /* unterminated
+    """
+    assert TokenParser._remove_comments(cdef) == expected
+
+    cdef = "#define D 'a/b'"
+    assert TokenParser._remove_comments(cdef) is cdef
+
+    # Single line comments followed by a carriage return are kept as is
+    cdef = "//a" * 10000 + "\r"
+    assert TokenParser._remove_comments(cdef) == cdef
+
+
+def test_remove_comments_unterminated() -> None:
+    # The missing comment end is only searched for once, searching again for every "/*" would take minutes here
+    cdef = "/* " * 100000
+
+    start = time.perf_counter()
+    assert TokenParser._remove_comments(cdef) == cdef
+    assert time.perf_counter() - start < 5
+
+
+def test_token_groupdict(cs: cstruct) -> None:
+    parser = TokenParser(cs)
+    token = parser._tokenize("enum Test : uint8 { A, B };")[0]
+
+    assert token.token == "ENUM"
+    assert parser.TOK.groupdict(token) == {"enumtype": "enum", "name": "Test", "type": "uint8", "values": " A, B "}
+
+
+def test_token_consumer_expect(cs: cstruct) -> None:
+    parser = TokenParser(cs)
+    data = "uint8 a;\nuint8"
+    tokens = TokenConsumer(parser._tokenize(data))
+
+    with pytest.raises(ParserError, match="line 1: expected EOL"):
+        tokens.expect(parser.TOK.EOL)
+
+    tokens.consume()
+    tokens.consume()
+    tokens.expect(parser.TOK.EOL)
+    assert tokens.previous.token == "EOL"
+
+    with pytest.raises(ParserError, match="line 2: expected EOL"):
+        tokens.expect(parser.TOK.EOL)
+
+    tokens.consume()
+    with pytest.raises(ParserError, match="line 2: expected EOL"):
+        tokens.expect(parser.TOK.EOL)
+
+
+@pytest.mark.parametrize("member", ["A B", "1A = 2", "A-B = 1", "= 1"])
+def test_invalid_enum_member(cs: cstruct, member: str) -> None:
+    with pytest.raises(ParserError, match=f"line 2: invalid enum member '{member}'"):
+        cs.load(f"\nenum Test : uint16 {{ {member} }};")
+
+
+def test_enum_members_line_breaks(cs: cstruct) -> None:
+    cs.load("enum Test : uint8 {\n    A =\n    B,\r    C = 5, D\r\n};")
+
+    assert cs.Test.A == 0
+    assert cs.Test.B == 1
+    assert cs.Test.C == 5
+    assert cs.Test.D == 6
@@ -233,6 +233,20 @@ def test_int_eof(cs: cstruct) -> None:
         cs.int24[None](b"\x01\x00\x00")
 
 
+def test_int_array_eof(cs: cstruct, compiled: bool) -> None:
+    cdef = """
+    struct test {
+        uint24  a[EOF];
+    };
+    """
+    cs.load(cdef, compiled=compiled)
+
+    assert verify_compiled(cs.test, compiled)
+
+    assert cs.test(b"AAABBBC").a == [0x414141, 0x424242]
+    assert cs.test(b"").a == []
+
+
 def test_int_range(cs: cstruct) -> None:
     int8 = cs._make_int_type("int8", 1, True)
     uint8 = cs._make_int_type("uint9", 1, False)